@@ -1,17 +1,25 @@
-from fastapi import FastAPI, Form, Request
+from fastapi import FastAPI, Form, Request, HTTPException
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from google.cloud import firestore
-from datetime import datetime, date
+from datetime import datetime, date, timedelta, timezone
 from dateutil import parser
 import os
+import json
+import hmac
+import shutil
+import math
+import time
+import logging
+import contextvars
 from fastapi import Query
 from datetime import date as dt_date
 from dateutil import parser
 from datetime import date as dt_date
 from pydantic import BaseModel
 from typing import List, Dict, Any
+from google.api_core.exceptions import AlreadyExists, GoogleAPICallError
 
 # Firestore credentials
 os.environ.setdefault("GOOGLE_APPLICATION_CREDENTIALS", "serviceAccount.json")
@@ -20,6 +28,10 @@ db = firestore.Client()
 app = FastAPI()
 
 templates = Jinja2Templates(directory="templates")
+logger = logging.getLogger(__name__)
+
+# offline-capable tablet client (public/): index.html, app.js, sw.js, manifest.json
+app.mount("/pwa", StaticFiles(directory="public", html=True), name="pwa")
 
 # --- helper functions ---
 def doc_to_row(doc):
@@ -36,6 +48,123 @@ def doc_to_row(doc):
 
 ##########################################################################################################
 
+# --- READ BUDGET ---
+# Firestore reads made while handling a request go through guarded_stream()/guarded_get(),
+# which count documents against a per-request budget and cap queries at what is left of it.
+# Per-route totals (per worker process) are served at /admin/read-costs.
+READ_BUDGET_PER_REQUEST = int(os.environ.get("READ_BUDGET_PER_REQUEST", "5000"))
+READ_BUDGET_ACTION = os.environ.get("READ_BUDGET_ACTION", "abort")  # 'abort' -> HTTP 400, 'truncate' -> stop reading
+MAX_PAGE_SIZE = 200
+
+
+class ReadBudget:
+    def __init__(self, limit, path=""):
+        self.limit = limit  # None = count reads but don't cap them
+        self.path = path
+        self.reads = 0
+        self.exceeded = False
+
+    def remaining(self):
+        return None if self.limit is None else max(self.limit - self.reads, 0)
+
+
+_read_budget = contextvars.ContextVar("read_budget", default=None)
+_read_costs = {}
+
+
+def clamp_limit(n):
+    """Keep client-supplied page_size/limit values within 1..MAX_PAGE_SIZE"""
+    return max(1, min(int(n), MAX_PAGE_SIZE))
+
+
+def lift_read_budget():
+    """Batch jobs read whole ranges on purpose: keep counting their reads but don't cap them"""
+    budget = _read_budget.get()
+    if budget is not None:
+        budget.limit = None
+
+
+def _count_read(budget, n=1):
+    """Count document reads; returns False once the budget is used up (after logging/aborting)"""
+    budget.reads += n
+    if budget.limit is None or budget.reads <= budget.limit:
+        return True
+    budget.exceeded = True
+    logger.warning("%s exceeded its read budget of %d documents", budget.path, budget.limit)
+    if READ_BUDGET_ACTION == "abort":
+        raise HTTPException(status_code=400, detail=f"Request would read more than {budget.limit} documents; narrow the filters")
+    return False
+
+
+def guarded_stream(query, limit=None):
+    """Stream a query (optionally limited) without reading past the current request's budget"""
+    budget = _read_budget.get()
+    remaining = budget.remaining() if budget is not None else None
+    if remaining is not None and (limit is None or limit > remaining):
+        # one document past the budget is enough to know it was exceeded
+        query = query.limit(remaining + 1)
+    elif limit is not None:
+        query = query.limit(limit)
+    for doc in query.stream():
+        if budget is not None and not _count_read(budget):
+            return
+        yield doc
+
+
+def guarded_get(doc_ref):
+    budget = _read_budget.get()
+    if budget is not None:
+        _count_read(budget)
+    return doc_ref.get()
+
+
+def guarded_aggregate(agg_query):
+    """
+    Run an aggregation query and return {alias: value}. Firestore bills one read
+    per 1000 index entries matched (at least one), which is counted against the budget.
+    """
+    values = {}
+    for result in agg_query.get():
+        for r in result:
+            values[r.alias] = r.value
+    budget = _read_budget.get()
+    if budget is not None:
+        _count_read(budget, max(1, math.ceil((values.get("count") or 0) / 1000)))
+    return values
+
+
+@app.middleware("http")
+async def read_budget_middleware(request: Request, call_next):
+    budget = ReadBudget(READ_BUDGET_PER_REQUEST, request.url.path)
+    token = _read_budget.set(budget)
+    try:
+        response = await call_next(request)
+    finally:
+        _read_budget.reset(token)
+    # key by route template; 404s and mounted static files share one key so clients can't grow the dict
+    route = request.scope.get("route")
+    stats = _read_costs.setdefault(getattr(route, "path", "<unmatched>"),
+                                   {"requests": 0, "reads": 0, "max_reads": 0, "exceeded": 0})
+    stats["requests"] += 1
+    stats["reads"] += budget.reads
+    stats["max_reads"] = max(stats["max_reads"], budget.reads)
+    stats["exceeded"] += int(budget.exceeded)
+    response.headers["X-Firestore-Reads"] = str(budget.reads)
+    return response
+
+
+@app.get("/admin/read-costs")
+async def read_costs():
+    """Firestore documents read per route since this worker started, most expensive first"""
+    routes = [
+        dict(route=path, avg_reads=round(st["reads"] / st["requests"], 1), **st)
+        for path, st in _read_costs.items()
+    ]
+    routes.sort(key=lambda r: r["reads"], reverse=True)
+    return JSONResponse({"budget_per_request": READ_BUDGET_PER_REQUEST, "action": READ_BUDGET_ACTION, "routes": routes})
+
+##########################################################################################################
+
 from fastapi.responses import RedirectResponse
 
 @app.get("/")
@@ -47,11 +176,11 @@ async def root():
 @app.get("/products", response_class=HTMLResponse)
 async def products_page(request: Request):
     # fetch products
-    docs = db.collection("products").stream()
+    docs = guarded_stream(db.collection("products"))
     products = [doc_to_row(doc) for doc in docs]
 
     # fetch units (document id or 'name' field if you prefer)
-    unit_docs = db.collection("units").stream()
+    unit_docs = guarded_stream(db.collection("units"))
     units = []
     for ud in unit_docs:
         d = ud.to_dict() or {}
@@ -62,7 +191,7 @@ async def products_page(request: Request):
     if not units:
         defaults = ["kg", "ltr", "nos"]
         for u in defaults:
-            db.collection("units").document(u).set({"name": u})
+            db.collection("units").document(u).set({"name": u, "updated_at": firestore.SERVER_TIMESTAMP})
         units = defaults
 
     return templates.TemplateResponse("products.html", {"request": request, "products": products, "units": units})
@@ -79,12 +208,12 @@ async def add_product(name: str = Form(...), unit: str = Form(...), custom_unit:
 
     if name:
         # save product document
-        db.collection("products").document(name).set({"name": name, "unit": chosen_unit})
+        db.collection("products").document(name).set({"name": name, "unit": chosen_unit, "updated_at": firestore.SERVER_TIMESTAMP})
 
         # also ensure the unit exists in units collection
         if chosen_unit:
             # use unit string as document id for simplicity
-            db.collection("units").document(chosen_unit).set({"name": chosen_unit})
+            db.collection("units").document(chosen_unit).set({"name": chosen_unit, "updated_at": firestore.SERVER_TIMESTAMP})
 
     return RedirectResponse("/products", status_code=303)
 
@@ -161,8 +290,9 @@ async def inventory_page(
         end_datetime = end_dt.strftime("%Y-%m-%dT%H:%M")
 
     # Fetch initial page
-    coll = db.collection("inventory").order_by("date", direction=firestore.Query.DESCENDING).limit(page_size)
-    docs = coll.stream()
+    page_size = clamp_limit(page_size)
+    coll = db.collection("inventory").order_by("date", direction=firestore.Query.DESCENDING)
+    docs = guarded_stream(coll, limit=page_size)
     initial = [_doc_to_inventory_dict(doc) for doc in docs]
 
     # Apply filters
@@ -174,7 +304,7 @@ async def inventory_page(
 
     has_more = len(initial) >= page_size
     today = now.strftime("%Y-%m-%dT%H:%M")
-    products = [p.to_dict() for p in db.collection("products").stream()]
+    products = [p.to_dict() for p in guarded_stream(db.collection("products"))]
 
     return templates.TemplateResponse("inventory.html", {
         "request": request,
@@ -200,14 +330,12 @@ async def inventory_data(
     product: str = None,
     party: str = None
 ):
+    limit = clamp_limit(limit)
     coll = db.collection("inventory").order_by("date", direction=firestore.Query.DESCENDING)
-    try:
-        if last_date_iso:
-            docs_iter = coll.start_after({"date": last_date_iso}).limit(limit).stream()
-        else:
-            docs_iter = coll.limit(limit).stream()
-    except Exception:
-        docs_iter = coll.stream()
+    if last_date_iso:
+        docs_iter = guarded_stream(coll.start_after({"date": last_date_iso}), limit=limit)
+    else:
+        docs_iter = guarded_stream(coll, limit=limit)
 
     now = datetime.now()
     start_dt = parser.parse(start_datetime).replace(tzinfo=None) if start_datetime else now.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -245,32 +373,42 @@ async def inventory_data(
     return JSONResponse({"inventory": results, "next_cursor": next_cursor, "has_more": has_more})
 
 
-@app.post("/inventory/add")
-async def add_inventory(
-    date: str = Form(...),
-    product: str = Form(...),
-    unit: str = Form(...),
-    quantity: float = Form(...),
-    price: float = Form(...),
-    party: str = Form(None)
-):
+def _parse_entry_date(date):
+    """Parse a submitted date/time into a naive local datetime (now, if unparseable)"""
     try:
         dt_obj = parser.parse(date)
         if dt_obj.tzinfo:
             dt_obj = dt_obj.astimezone().replace(tzinfo=None)
     except Exception:
         dt_obj = datetime.utcnow()
+    return dt_obj
+
 
+def _new_inventory_doc(date, product, unit, quantity, price, party=None):
+    """Inventory document as written by the form and by /sync/push"""
     total = float(quantity) * float(price)
-    db.collection("inventory").add({
-        "date": dt_obj.isoformat(),
+    return {
+        "date": _parse_entry_date(date).isoformat(),
         "product": product,
         "unit": unit,
         "quantity": float(quantity),
         "price": float(price),
         "total": total,
-        "party": party or ""
-    })
+        "party": party or "",
+        "updated_at": firestore.SERVER_TIMESTAMP
+    }
+
+
+@app.post("/inventory/add")
+async def add_inventory(
+    date: str = Form(...),
+    product: str = Form(...),
+    unit: str = Form(...),
+    quantity: float = Form(...),
+    price: float = Form(...),
+    party: str = Form(None)
+):
+    db.collection("inventory").add(_new_inventory_doc(date, product, unit, quantity, price, party))
     return RedirectResponse("/inventory", status_code=303)
 
 ##########################################################################################################
@@ -342,8 +480,9 @@ async def sales_page(
         end_datetime = end_dt.strftime("%Y-%m-%dT%H:%M")
 
     # Fetch initial page
-    coll = db.collection("sales").order_by("date", direction=firestore.Query.DESCENDING).limit(page_size)
-    docs = coll.stream()
+    page_size = clamp_limit(page_size)
+    coll = db.collection("sales").order_by("date", direction=firestore.Query.DESCENDING)
+    docs = guarded_stream(coll, limit=page_size)
     initial = [_doc_to_sale_dict(doc) for doc in docs]
 
     # Apply filters
@@ -351,7 +490,7 @@ async def sales_page(
 
     has_more = len(initial) >= page_size
     today = now.strftime("%Y-%m-%dT%H:%M")
-    products = [p.to_dict() for p in db.collection("products").stream()]
+    products = [p.to_dict() for p in guarded_stream(db.collection("products"))]
 
     return templates.TemplateResponse("sales.html", {
         "request": request,
@@ -374,14 +513,12 @@ async def sales_data(
     limit: int = PAGE_SIZE_DEFAULT,
     product: str = None
 ):
+    limit = clamp_limit(limit)
     coll = db.collection("sales").order_by("date", direction=firestore.Query.DESCENDING)
-    try:
-        if last_date_iso:
-            docs_iter = coll.start_after({"date": last_date_iso}).limit(limit).stream()
-        else:
-            docs_iter = coll.limit(limit).stream()
-    except Exception:
-        docs_iter = coll.stream()
+    if last_date_iso:
+        docs_iter = guarded_stream(coll.start_after({"date": last_date_iso}), limit=limit)
+    else:
+        docs_iter = guarded_stream(coll, limit=limit)
 
     now = datetime.now()
     start_dt = parser.parse(start_datetime).replace(tzinfo=None) if start_datetime else now.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -415,6 +552,20 @@ async def sales_data(
     has_more = len(results) >= limit
     return JSONResponse({"sales": results, "next_cursor": next_cursor, "has_more": has_more})
 
+def _new_sale_doc(date, product, unit, quantity, price):
+    """Sale document as written by the form and by /sync/push"""
+    total = float(quantity) * float(price)
+    return {
+        "date": _parse_entry_date(date).isoformat(),
+        "product": product,
+        "unit": unit,
+        "quantity": float(quantity),
+        "price": float(price),
+        "total": total,
+        "updated_at": firestore.SERVER_TIMESTAMP
+    }
+
+
 @app.post("/sales/add")
 async def add_sale(
     date: str = Form(...),
@@ -423,22 +574,7 @@ async def add_sale(
     quantity: float = Form(...),
     price: float = Form(...)
 ):
-    try:
-        dt_obj = parser.parse(date)
-        if dt_obj.tzinfo:
-            dt_obj = dt_obj.astimezone().replace(tzinfo=None)
-    except Exception:
-        dt_obj = datetime.utcnow()
-
-    total = float(quantity) * float(price)
-    db.collection("sales").add({
-        "date": dt_obj.isoformat(),
-        "product": product,
-        "unit": unit,
-        "quantity": float(quantity),
-        "price": float(price),
-        "total": total
-    })
+    db.collection("sales").add(_new_sale_doc(date, product, unit, quantity, price))
     return RedirectResponse("/sales", status_code=303)
 
 ##########################################################################################################
@@ -533,8 +669,9 @@ async def orders_page(
         end_datetime = end_dt.strftime("%Y-%m-%dT%H:%M")
 
     # Query Firestore for initial page (cursor-based approach)
-    coll = db.collection("orders").order_by("date", direction=firestore.Query.DESCENDING).limit(page_size)
-    docs = coll.stream()
+    page_size = clamp_limit(page_size)
+    coll = db.collection("orders").order_by("date", direction=firestore.Query.DESCENDING)
+    docs = guarded_stream(coll, limit=page_size)
 
     initial = []
     for doc in docs:
@@ -550,9 +687,17 @@ async def orders_page(
     if len(initial) == page_size:
         has_more = True
 
+    # status counts / amounts come from aggregation queries, not from the fetched page;
+    # if they fail (e.g. composite index not deployed yet) the page renders without them
+    try:
+        summary = _orders_summary(start_dt, end_dt, product=product)
+    except GoogleAPICallError:
+        logger.exception("orders summary aggregation failed")
+        summary = None
+
     today = now.strftime("%Y-%m-%dT%H:%M")
     # fetch product list for filter options
-    products = [p.to_dict() for p in db.collection("products").stream()]
+    products = [p.to_dict() for p in guarded_stream(db.collection("products"))]
 
     return templates.TemplateResponse("orders.html", {
         "request": request,
@@ -563,6 +708,7 @@ async def orders_page(
         "product_filter": product or "All",
         "party_filter": party or "",
         "status_filter": status or "All",
+        "summary": summary,
         "today": today,
         "active_tab": tab,
         "page_size": page_size,
@@ -582,15 +728,12 @@ async def orders_data(
     """
     Return next page slice in JSON. Accepts same filters as /orders and last_date_iso cursor.
     """
+    limit = clamp_limit(limit)
     coll = db.collection("orders").order_by("date", direction=firestore.Query.DESCENDING)
-    docs_iter = None
-    try:
-        if last_date_iso:
-            docs_iter = coll.start_after({"date": last_date_iso}).limit(limit).stream()
-        else:
-            docs_iter = coll.limit(limit).stream()
-    except Exception:
-        docs_iter = coll.stream()
+    if last_date_iso:
+        docs_iter = guarded_stream(coll.start_after({"date": last_date_iso}), limit=limit)
+    else:
+        docs_iter = guarded_stream(coll, limit=limit)
 
     now = datetime.now()
     if start_datetime:
@@ -641,31 +784,73 @@ async def orders_data(
     has_more = len(results) >= limit
     return JSONResponse({"orders": results, "next_cursor": next_cursor, "has_more": has_more})
 
-# Accept form data for adding orders (form submission)
-@app.post("/orders/add")
-async def add_order(
-    date: str = Form(...),
-    product: str = Form(...),
-    quantity: float = Form(...),
-    unit: str = Form(...),
-    price: float = Form(...),
-    party: str = Form(...),
-    advance: float = Form(0.0)
+# ---------- Orders summary (Firestore aggregation queries) ----------
+ORDER_STATUSES = ("Pending", "Completed", "Cancelled")
+ORDERS_SUMMARY_TTL = 60  # seconds; also cleared whenever an order is added or updated
+_orders_summary_cache = {}
+
+
+def _orders_summary(start_dt, end_dt, product=None):
+    """
+    Count, total and remain_amount per status for orders in [start_dt, end_dt] (optionally one product).
+    Uses count()/sum() aggregation queries, so no order documents are read, and caches per filter set.
+    Needs the composite indexes in firestore.indexes.json (firebase deploy --only firestore:indexes).
+    The party filter can't be applied server-side (substring match), so it is not part of the summary.
+    """
+    key = (start_dt.isoformat(), end_dt.isoformat(), product or "All")
+    now = time.monotonic()
+    cached = _orders_summary_cache.get(key)
+    if cached and now - cached[0] < ORDERS_SUMMARY_TTL:
+        return cached[1]
+
+    query = db.collection("orders").where("date", ">=", start_dt.isoformat()).where("date", "<=", end_dt.isoformat())
+    if product and product != "All":
+        query = query.where("product", "==", product)
+
+    def aggregate(q):
+        values = guarded_aggregate(q.count(alias="count").sum("total", alias="total").sum("remain_amount", alias="remain_amount"))
+        return {
+            "count": int(values.get("count") or 0),
+            "total": float(values.get("total") or 0),
+            "remain_amount": float(values.get("remain_amount") or 0)
+        }
+
+    # overall figures get their own query: orders without a status field (or with another
+    # status) match none of the per-status queries
+    summary = aggregate(query)
+    summary["by_status"] = {status: aggregate(query.where("status", "==", status)) for status in ORDER_STATUSES}
+
+    for k in [k for k, (ts, _) in _orders_summary_cache.items() if now - ts >= ORDERS_SUMMARY_TTL]:
+        del _orders_summary_cache[k]
+    _orders_summary_cache[key] = (now, summary)
+    return summary
+
+
+@app.get("/orders/summary")
+async def orders_summary(
+    start_datetime: str = None,
+    end_datetime: str = None,
+    product: str = None
 ):
-    try:
-        dt_obj = parser.parse(date)
-        if dt_obj.tzinfo:
-            dt_obj = dt_obj.astimezone().replace(tzinfo=None)
-    except Exception:
-        dt_obj = datetime.utcnow()
+    """Order counts and amounts by status for the same date/product filters as /orders."""
+    now = datetime.now()
+    if start_datetime:
+        start_dt = parser.parse(start_datetime).replace(tzinfo=None)
+    else:
+        start_dt = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if end_datetime:
+        end_dt = parser.parse(end_datetime).replace(tzinfo=None)
+    else:
+        end_dt = now.replace(hour=23, minute=59, second=0, microsecond=0)
+    return JSONResponse(_orders_summary(start_dt, end_dt, product=product))
 
+def _new_order_doc(date, product, quantity, unit, price, party, advance=0.0):
+    """Order document as written by the form and by /sync/push"""
     total = float(quantity) * float(price)
     paid_amount = 0.0
     remain_amount = total - float(advance) - paid_amount
-
-    doc_ref = db.collection("orders").document()
-    doc_ref.set({
-        "date": dt_obj.isoformat(),
+    return {
+        "date": _parse_entry_date(date).isoformat(),
         "product": product,
         "quantity": float(quantity),
         "unit": unit,
@@ -675,17 +860,13 @@ async def add_order(
         "advance": float(advance),
         "paid_amount": float(paid_amount),
         "remain_amount": float(remain_amount),
-        "status": "Pending"
-    })
-    return RedirectResponse(url="/orders?tab=new", status_code=303)
+        "status": "Pending",
+        "updated_at": firestore.SERVER_TIMESTAMP
+    }
 
-@app.post("/orders/{order_id}/update")
-async def update_order(order_id: str, data: dict):
-    doc_ref = db.collection("orders").document(order_id)
-    doc = doc_ref.get()
-    if not doc.exists:
-        raise HTTPException(status_code=404, detail="Order not found")
 
+def _order_update_fields(data):
+    """Editable order fields from an update payload (empty dict if nothing to change)"""
     updated_data = {}
     if "status" in data:
         updated_data["status"] = str(data["status"])
@@ -695,11 +876,577 @@ async def update_order(order_id: str, data: dict):
         updated_data["remain_amount"] = float(data["remain_amount"])
     if "advance" in data:
         updated_data["advance"] = float(data["advance"])
+    if updated_data:
+        updated_data["updated_at"] = firestore.SERVER_TIMESTAMP
+    return updated_data
+
+
+# Accept form data for adding orders (form submission)
+@app.post("/orders/add")
+async def add_order(
+    date: str = Form(...),
+    product: str = Form(...),
+    quantity: float = Form(...),
+    unit: str = Form(...),
+    price: float = Form(...),
+    party: str = Form(...),
+    advance: float = Form(0.0)
+):
+    doc_ref = db.collection("orders").document()
+    doc_ref.set(_new_order_doc(date, product, quantity, unit, price, party, advance))
+    _orders_summary_cache.clear()
+    return RedirectResponse(url="/orders?tab=new", status_code=303)
+
+@app.post("/orders/{order_id}/update")
+async def update_order(order_id: str, data: dict):
+    doc_ref = db.collection("orders").document(order_id)
+    doc = guarded_get(doc_ref)
+    if not doc.exists:
+        raise HTTPException(status_code=404, detail="Order not found")
 
+    updated_data = _order_update_fields(data)
     if updated_data:
         doc_ref.update(updated_data)
+        _orders_summary_cache.clear()
     return JSONResponse({"success": True})
 
+##########################################################################################################
+
+# --- SYNC ---
+# Delta sync for the offline tablet client (/pwa). Every write sets "updated_at" to the server
+# timestamp; /sync?since=<version> returns documents with updated_at after that version.
+# Versions are opaque integers (microseconds since epoch). Without "since", the client gets a
+# bootstrap: all products/units plus the last SYNC_RECENT_DAYS of inventory/sales/orders.
+# Documents written before "updated_at" existed only ever arrive through the bootstrap.
+SYNC_COLLECTIONS = {
+    "inventory": _doc_to_inventory_dict,
+    "sales": _doc_to_sale_dict,
+    "orders": _doc_to_order_dict,
+}
+SYNC_REFERENCE_COLLECTIONS = ("products", "units")
+SYNC_RECENT_DAYS = 7
+SYNC_CLOCK_SKEW = timedelta(seconds=30)  # bootstrap version is set back by this much; re-sent rows are upserts
+
+
+def _to_version(ts):
+    return int(ts.timestamp() * 1_000_000)
+
+
+def _from_version(version):
+    return datetime.fromtimestamp(version / 1_000_000, tz=timezone.utc)
+
+
+def _sync_row(d):
+    """JSON-safe row: drop parsed datetimes, turn updated_at into a version"""
+    row = {k: v for k, v in d.items() if k not in ("date_dt", "updated_at")}
+    if isinstance(d.get("updated_at"), datetime):
+        row["version"] = _to_version(d["updated_at"])
+    return row
+
+
+def _sync_rows(collection, query, limit=None):
+    normalize = SYNC_COLLECTIONS.get(collection)
+    rows = []
+    for doc in guarded_stream(query, limit=limit):
+        if normalize:
+            d = normalize(doc)
+        else:
+            d = doc.to_dict() or {}
+            d["id"] = doc.id
+        rows.append(_sync_row(d))
+    return rows
+
+
+def _sync_bootstrap(cursor, limit):
+    """
+    One page of the bootstrap. The cursor is "<version>:<collection>:<last date_iso>": the version
+    is fixed on the first page and only returned with the last one, so the client starts deltas from
+    before the bootstrap began and anything written meanwhile arrives with them.
+    """
+    out = {}
+    if cursor:
+        try:
+            version, stage, last_date = cursor.split(":", 2)
+            version = int(version)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="invalid cursor")
+        if stage not in SYNC_COLLECTIONS:
+            raise HTTPException(status_code=400, detail="invalid cursor")
+    else:
+        version = _to_version(datetime.now(timezone.utc) - SYNC_CLOCK_SKEW)
+        stage, last_date = next(iter(SYNC_COLLECTIONS)), None
+        for collection in SYNC_REFERENCE_COLLECTIONS:
+            out[collection] = _sync_rows(collection, db.collection(collection))
+
+    recent = (date.today() - timedelta(days=SYNC_RECENT_DAYS)).isoformat()
+    collections = list(SYNC_COLLECTIONS)
+    room = limit
+    for collection in collections[collections.index(stage):]:
+        query = (db.collection(collection).where("date", ">=", recent)
+                 .order_by("date", direction=firestore.Query.DESCENDING))
+        if collection == stage and last_date:
+            # start_at, not start_after: rows sharing the boundary date are sent again rather than
+            # skipped (the client upserts by id)
+            rows = _sync_rows(collection, query.start_at({"date": last_date}), limit=room)
+            if len(rows) >= room and rows[-1]["date_iso"] == last_date:
+                # a whole page on one date would come back forever: step past that date (rows beyond
+                # a full page sharing one timestamp are skipped, as with the other date cursors)
+                rows = _sync_rows(collection, query.start_after({"date": last_date}), limit=room)
+        else:
+            rows = _sync_rows(collection, query, limit=room)
+        out[collection] = rows
+        room -= len(rows)
+        if room <= 0:
+            next_cursor = f"{version}:{collection}:{rows[-1]['date_iso']}"
+            return {"version": None, "has_more": True, "next_cursor": next_cursor, **out}
+        last_date = None
+    return {"version": version, "has_more": False, **out}
+
+
+@app.get("/sync")
+async def sync(since: int = None, cursor: str = None, limit: int = MAX_PAGE_SIZE):
+    """
+    Documents changed since a client version. Returns {"version", "has_more", <collection>: [rows]}.
+    Each collection returns at most `limit` rows; when any collection is cut off, has_more is true
+    and version stops at the oldest cut-off point, so the client just calls again with it.
+    Without since, returns the bootstrap in pages of `limit` inventory/sales/orders rows (products
+    and units come with the first page): while has_more, call again with next_cursor; version is
+    only set on the last page.
+    """
+    limit = clamp_limit(limit)
+    if since is None:
+        return JSONResponse(_sync_bootstrap(cursor, limit))
+
+    out = {}
+    cutoffs = []
+    newest = since
+    for collection in SYNC_REFERENCE_COLLECTIONS + tuple(SYNC_COLLECTIONS):
+        query = db.collection(collection).where("updated_at", ">", _from_version(since)).order_by("updated_at")
+        rows = _sync_rows(collection, query, limit=limit)
+        out[collection] = rows
+        if rows:
+            newest = max(newest, rows[-1].get("version", since))
+            if len(rows) >= limit:
+                cutoffs.append(rows[-1].get("version", since))
+    version = min(cutoffs) if cutoffs else newest
+    return JSONResponse({"version": version, "has_more": bool(cutoffs), **out})
+
+
+class SyncOp(BaseModel):
+    id: str  # client-generated; used as the document id so replays are idempotent
+    collection: str
+    op: str = "add"  # 'add' or 'update' (orders only)
+    doc_id: str = None
+    data: Dict[str, Any] = {}
+
+
+@app.post("/sync/push")
+async def sync_push(ops: List[SyncOp]):
+    """
+    Apply writes queued by the offline client. Adds use the op id as document id and create(),
+    so an op replayed after a lost response is reported as applied instead of duplicated.
+    """
+    applied, failed = [], []
+    for op in ops:
+        try:
+            data = op.data
+            if op.op == "add" and op.collection == "inventory":
+                doc = _new_inventory_doc(data["date"], data["product"], data["unit"], data["quantity"], data["price"], data.get("party"))
+            elif op.op == "add" and op.collection == "sales":
+                doc = _new_sale_doc(data["date"], data["product"], data["unit"], data["quantity"], data["price"])
+            elif op.op == "add" and op.collection == "orders":
+                doc = _new_order_doc(data["date"], data["product"], data["quantity"], data["unit"], data["price"],
+                                     data["party"], data.get("advance", 0.0))
+            elif op.op == "update" and op.collection == "orders" and op.doc_id:
+                doc_ref = db.collection("orders").document(op.doc_id)
+                if not guarded_get(doc_ref).exists:
+                    raise ValueError("Order not found")
+                updated_data = _order_update_fields(data)
+                if updated_data:
+                    doc_ref.update(updated_data)
+                    _orders_summary_cache.clear()
+                applied.append(op.id)
+                continue
+            else:
+                raise ValueError(f"unsupported op {op.op!r} on {op.collection!r}")
+
+            try:
+                db.collection(op.collection).document(op.id).create(doc)
+            except AlreadyExists:
+                pass
+            if op.collection == "orders":
+                _orders_summary_cache.clear()
+            applied.append(op.id)
+        except KeyError as e:
+            failed.append({"id": op.id, "error": f"missing field {e}"})
+        except (TypeError, ValueError) as e:
+            failed.append({"id": op.id, "error": str(e)})
+    return JSONResponse({"applied": applied, "failed": failed})
+
+##########################################################################################################
+
+# --- SNAPSHOTS ---
+# Columnar (Parquet) copies of inventory/sales/orders on local disk, so reports over older
+# ranges can scan files instead of streaming whole collections from Firestore.
+# Layout: <SNAPSHOT_DIR>/<collection>/month=YYYY-MM/part-<run>.parquet
+# Each collection has a watermark in _watermark.json: the updated_at version (see SYNC) exported
+# up to. A run exports documents written since then, whatever their date, so back-dated entries
+# and edited orders are picked up; an edited document is exported again and readers keep the
+# newest copy of each id. Without a watermark (first run, or one from before versions were
+# tracked) the collection's files are replaced by a full export.
+# On App Engine standard (app.yaml) only /tmp is writable. It is in-memory and cleared when the
+# instance stops (min_instances: 0), so files and watermark are lost together and the next run
+# re-exports everything. For snapshots that survive restarts, use the Docker deployment with a
+# persistent SNAPSHOT_DIR.
+# pyarrow is imported inside the functions that need it: it costs ~50 MB per worker process,
+# which only the snapshot job and source=snapshot reports should pay.
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "/tmp/snapshots" if os.environ.get("GAE_ENV") == "standard" else "snapshots")
+SNAPSHOT_WATERMARK_FILE = os.path.join(SNAPSHOT_DIR, "_watermark.json")
+
+SNAPSHOT_COLUMNS = {
+    "inventory": ["id", "date_iso", "date", "product", "unit", "quantity", "price", "total", "party"],
+    "sales": ["id", "date_iso", "date", "product", "unit", "quantity", "price", "total"],
+    "orders": ["id", "date_iso", "date", "product", "unit", "quantity", "price", "total", "party",
+               "advance", "paid_amount", "remain_amount", "status"],
+}
+_SNAPSHOT_STRING_COLUMNS = {"id", "date_iso", "date", "product", "unit", "party", "status"}
+_SNAPSHOT_VERSION_COLUMN = "version"  # updated_at version of the exported copy (null for older documents)
+
+_SNAPSHOT_NORMALIZERS = {
+    "inventory": _doc_to_inventory_dict,
+    "sales": _doc_to_sale_dict,
+    "orders": _doc_to_order_dict,
+}
+
+
+def _snapshot_schema(collection, with_version=False):
+    import pyarrow as pa
+    fields = [
+        (c, pa.string() if c in _SNAPSHOT_STRING_COLUMNS else pa.float64())
+        for c in SNAPSHOT_COLUMNS[collection]
+    ]
+    if with_version:
+        fields.append((_SNAPSHOT_VERSION_COLUMN, pa.int64()))
+    return pa.schema(fields)
+
+
+def _snapshot_table(collection, rows, with_version=False):
+    """Build an Arrow table from normalized dicts, keeping only the snapshot columns"""
+    import pyarrow as pa
+    schema = _snapshot_schema(collection, with_version)
+    return pa.Table.from_pylist([{c: r.get(c) for c in schema.names} for r in rows], schema=schema)
+
+
+def _snapshot_version(marks, collection):
+    """Exported-up-to version, or None (watermarks from before versions were tracked are dates)"""
+    version = marks.get(collection)
+    return version if isinstance(version, int) else None
+
+
+def _load_snapshot_watermarks():
+    try:
+        with open(SNAPSHOT_WATERMARK_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_snapshot_watermarks(marks):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    tmp_path = SNAPSHOT_WATERMARK_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(marks, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, SNAPSHOT_WATERMARK_FILE)
+
+
+def export_snapshot(collection):
+    """Append documents written since the collection's watermark as month-partitioned Parquet files"""
+    import pyarrow.parquet as pq
+    marks = _load_snapshot_watermarks()
+    since = _snapshot_version(marks, collection)
+    # rows committed just before now may not be visible yet; leave them to the next run
+    cutoff = datetime.now(timezone.utc) - SYNC_CLOCK_SKEW
+
+    query = db.collection(collection)
+    if since is not None:
+        query = query.where("updated_at", ">", _from_version(since)).where("updated_at", "<=", cutoff)
+    else:
+        shutil.rmtree(os.path.join(SNAPSHOT_DIR, collection), ignore_errors=True)
+
+    normalize = _SNAPSHOT_NORMALIZERS[collection]
+    by_month = {}
+    count = 0
+    for doc in guarded_stream(query):
+        d = normalize(doc)
+        updated_at = d.get("updated_at")
+        if isinstance(updated_at, datetime):
+            if updated_at > cutoff:
+                continue
+            d[_SNAPSHOT_VERSION_COLUMN] = _to_version(updated_at)
+        if not d["date_iso"]:
+            continue
+        by_month.setdefault(d["date_iso"][:7], []).append(d)
+        count += 1
+
+    run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    for month, rows in by_month.items():
+        part_dir = os.path.join(SNAPSHOT_DIR, collection, f"month={month}")
+        os.makedirs(part_dir, exist_ok=True)
+        table = _snapshot_table(collection, rows, with_version=True)
+        pq.write_table(table, os.path.join(part_dir, f"part-{run_id}.parquet"))
+
+    marks[collection] = _to_version(cutoff)
+    _save_snapshot_watermarks(marks)
+    return {"exported": count, "watermark": marks[collection]}
+
+
+def query_snapshot(collection, start_iso=None, end_iso=None):
+    """Scan snapshot files for start_iso <= date_iso < end_iso (memory-mapped, month partitions pruned)"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs as pa_fs
+    path = os.path.join(SNAPSHOT_DIR, collection)
+    if not os.path.isdir(path):
+        return _snapshot_schema(collection).empty_table()
+
+    dataset = ds.dataset(
+        path,
+        format="parquet",
+        filesystem=pa_fs.LocalFileSystem(use_mmap=True),
+        partitioning=ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive"),
+    )
+    expr = None
+    if start_iso:
+        expr = (ds.field("month") >= start_iso[:7]) & (ds.field("date_iso") >= start_iso)
+    if end_iso:
+        end_expr = (ds.field("month") <= end_iso[:7]) & (ds.field("date_iso") < end_iso)
+        expr = end_expr if expr is None else expr & end_expr
+    columns = SNAPSHOT_COLUMNS[collection]
+    table = dataset.to_table(columns=columns + [_SNAPSHOT_VERSION_COLUMN], filter=expr)
+
+    # edited documents are exported again (and a run that died before saving its watermark
+    # exports rows twice): keep the newest copy of each id. A document's date never changes,
+    # so all its copies fall in the same range.
+    if table.num_rows:
+        table = table.sort_by([(_SNAPSHOT_VERSION_COLUMN, "descending")])
+        table = table.append_column("_row", pa.array(range(table.num_rows)))
+        newest = table.group_by("id", use_threads=False).aggregate([("_row", "min")])["_row_min"]
+        table = table.take(newest)
+    return table.select(columns)
+
+
+# Batch jobs read whole collections, so they run without the per-request read budget and only
+# for trusted callers: App Engine cron / task queues (App Engine strips X-Appengine-* headers
+# from outside requests, so they are only trusted when running there), or anyone sending the
+# BATCH_JOB_TOKEN secret in X-Batch-Job-Token. Without BATCH_JOB_TOKEN set, only App Engine can run jobs.
+BATCH_JOB_TOKEN = os.environ.get("BATCH_JOB_TOKEN")
+
+
+def _is_trusted_job_caller(request):
+    if os.environ.get("GAE_ENV") and (
+        request.headers.get("X-Appengine-Cron") == "true" or request.headers.get("X-Appengine-QueueName")
+    ):
+        return True
+    token = request.headers.get("X-Batch-Job-Token")
+    return bool(BATCH_JOB_TOKEN and token and hmac.compare_digest(token, BATCH_JOB_TOKEN))
+
+
+def _authorize_batch_job(request):
+    """Reject untrusted callers (403), otherwise lift the read budget for the job"""
+    if not _is_trusted_job_caller(request):
+        raise HTTPException(status_code=403, detail="Batch jobs run from App Engine cron or with X-Batch-Job-Token")
+    lift_read_budget()
+
+
+@app.api_route("/snapshots/run", methods=["GET", "POST"])
+async def run_snapshots(request: Request):
+    """
+    Export new inventory/sales/orders documents to the snapshot files.
+    Runs daily from App Engine cron (cron.yaml); see _is_trusted_job_caller for who may call it.
+    """
+    _authorize_batch_job(request)
+    return JSONResponse({c: export_snapshot(c) for c in SNAPSHOT_COLUMNS})
+
+##########################################################################################################
+
+# --- COSTING ---
+# Cost of goods sold per product, from purchase prices in "inventory" matched against "sales".
+# State lives in Firestore under costing/<method>:
+#   costing/<method>                      -> checkpoint {"watermark": latest processed transaction date,
+#                                                        "version": updated_at version processed up to}
+#   costing/<method>/products/<product>   -> stock state (FIFO lots or weighted-average cost)
+#   costing/<method>/periods/<YYYY-MM>    -> {"days": {YYYY-MM-DD: {product: {qty, revenue, cogs}}}}
+# Each run picks up transactions by when they were written (server "updated_at", see SYNC), not by
+# their date, which users choose and the offline client may push days later. A new transaction
+# dated before the watermark would have to be costed in the middle of already-processed history,
+# so the run replays everything instead (as /costing/run?rebuild=1 does on demand). Checkpoints
+# without a version (from before updated_at was tracked) also get a full replay.
+COSTING_METHODS = ("fifo", "average")
+FIRESTORE_BATCH_LIMIT = 500  # max writes per WriteBatch
+
+
+def _costing_ref(method):
+    return db.collection("costing").document(method)
+
+
+def _new_cost_state():
+    return {"lots": [], "qty": 0.0, "avg_cost": 0.0, "last_price": 0.0, "shortfall_qty": 0.0}
+
+
+def _apply_purchase(method, state, qty, price):
+    """Add purchased stock to a product's cost state"""
+    if method == "fifo":
+        state["lots"].append({"qty": qty, "price": price})
+    else:
+        stock_value = state["qty"] * state["avg_cost"] + qty * price
+        state["qty"] += qty
+        state["avg_cost"] = stock_value / state["qty"] if state["qty"] > 0 else price
+    state["last_price"] = price
+
+
+def _apply_sale(method, state, qty):
+    """Remove sold stock from a product's cost state and return its cost of goods"""
+    cost = 0.0
+    remaining = qty
+    if method == "fifo":
+        lots = state["lots"]
+        while remaining > 1e-9 and lots:
+            lot = lots[0]
+            take = min(lot["qty"], remaining)
+            cost += take * lot["price"]
+            remaining -= take
+            lot["qty"] -= take
+            if lot["qty"] <= 1e-9:
+                lots.pop(0)
+    else:
+        take = min(state["qty"], remaining)
+        cost += take * state["avg_cost"]
+        remaining -= take
+        state["qty"] -= take
+    if remaining > 1e-9:
+        # sold more than was ever purchased: cost the shortfall at the last known purchase price
+        cost += remaining * state["last_price"]
+        state["shortfall_qty"] += remaining
+    return cost
+
+
+def _costing_events(since, cutoff):
+    """
+    Inventory/sales transactions written after version `since` (all when None) and up to `cutoff`,
+    as (raw date, kind, normalized dict) sorted by date; purchases sort before sales at the same timestamp.
+    """
+    events = []
+    for kind, collection, normalize in ((0, "inventory", _doc_to_inventory_dict), (1, "sales", _doc_to_sale_dict)):
+        query = db.collection(collection)
+        if since is not None:
+            query = query.where("updated_at", ">", _from_version(since)).where("updated_at", "<=", cutoff)
+        for doc in guarded_stream(query):
+            raw_date = str(doc.get("date"))
+            d = normalize(doc)
+            # a full replay skips rows written after the cutoff; the next run picks them up
+            if isinstance(d.get("updated_at"), datetime) and d["updated_at"] > cutoff:
+                continue
+            if d["date_iso"] and d["product"]:
+                events.append((raw_date, kind, d))
+    events.sort(key=lambda e: (e[0], e[1]))
+    return events
+
+
+def run_costing(method, rebuild=False):
+    """
+    Process inventory/sales transactions written since the checkpoint and persist the new state.
+    With rebuild (or when a back-dated transaction turns up), stored state is replaced by a replay
+    of all transactions.
+    """
+    ref = _costing_ref(method)
+    # rows committed just before now may not be visible yet; leave them to the next run
+    cutoff = datetime.now(timezone.utc) - SYNC_CLOCK_SKEW
+    checkpoint = {}
+    if not rebuild:
+        snap = guarded_get(ref)
+        checkpoint = (snap.to_dict() or {}) if snap.exists else {}
+        rebuild = checkpoint.get("version") is None
+    back_dated = 0
+    if rebuild:
+        events = _costing_events(None, cutoff)
+    else:
+        events = _costing_events(checkpoint.get("version"), cutoff)
+        since_date = checkpoint.get("watermark")
+        back_dated = sum(1 for e in events if since_date and e[0] < since_date)
+        if back_dated:
+            logger.warning("costing %s: %d transactions dated before %s, replaying all", method, back_dated, since_date)
+            rebuild = True
+            events = _costing_events(None, cutoff)
+    if not events and not rebuild:
+        return {"processed": 0, "watermark": checkpoint.get("watermark")}
+
+    states = {p.id: p.to_dict() for p in guarded_stream(ref.collection("products"))}
+    stale_products, stale_periods = [], []
+    if rebuild:
+        stale_products = list(states)
+        stale_periods = [p.id for p in guarded_stream(ref.collection("periods"))]
+        states = {}
+    periods = {}
+    touched = set()
+    for raw_date, kind, d in events:
+        state = states.setdefault(d["product"], _new_cost_state())
+        touched.add(d["product"])
+        if kind == 0:
+            _apply_purchase(method, state, d["quantity"], d["price"])
+            continue
+        cogs = _apply_sale(method, state, d["quantity"])
+        month = d["date_iso"][:7]
+        if month not in periods:
+            if rebuild:
+                periods[month] = {"days": {}}
+            else:
+                period_doc = guarded_get(ref.collection("periods").document(month))
+                periods[month] = (period_doc.to_dict() if period_doc.exists else None) or {"days": {}}
+        day = periods[month]["days"].setdefault(d["date_iso"][:10], {})
+        row = day.setdefault(d["product"], {"qty": 0.0, "revenue": 0.0, "cogs": 0.0})
+        row["qty"] += d["quantity"]
+        row["revenue"] += d["total"]
+        row["cogs"] += cogs
+
+    # state and checkpoint are committed together in one batch, so a failed run is simply
+    # retried; splitting it would let a retry re-apply transactions to already-saved state
+    deletes = [ref.collection("products").document(p) for p in stale_products if p not in touched]
+    deletes += [ref.collection("periods").document(m) for m in stale_periods if m not in periods]
+    n_writes = len(deletes) + len(touched) + len(periods) + 1
+    if n_writes > FIRESTORE_BATCH_LIMIT:
+        logger.error("costing run for %s needs %d writes, over the batch limit", method, n_writes)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Costing run would write {n_writes} documents, over Firestore's {FIRESTORE_BATCH_LIMIT}-write "
+                   f"batch limit; nothing was saved"
+        )
+    batch = db.batch()
+    for doc_ref in deletes:
+        batch.delete(doc_ref)
+    for product in touched:
+        batch.set(ref.collection("products").document(product), states[product])
+    for month, period in periods.items():
+        batch.set(ref.collection("periods").document(month), period)
+    watermark = events[-1][0] if events else None
+    batch.set(ref, {"watermark": watermark, "version": _to_version(cutoff), "updated_at": datetime.now().isoformat()})
+    batch.commit()
+    return {"processed": len(events), "watermark": watermark, "rebuilt": rebuild, "back_dated": back_dated}
+
+
+@app.api_route("/costing/run", methods=["GET", "POST"])
+async def run_costing_endpoint(request: Request, method: str = None, rebuild: bool = False):
+    """
+    Run the costing engine for one method (or all). Runs daily from App Engine cron (cron.yaml).
+    rebuild=1 forces a replay of all transactions (runs also replay on their own when back-dated ones turn up).
+    """
+    methods = [method] if method else list(COSTING_METHODS)
+    if any(m not in COSTING_METHODS for m in methods):
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(COSTING_METHODS)}")
+    _authorize_batch_job(request)
+    return JSONResponse({m: run_costing(m, rebuild=rebuild) for m in methods})
+
+##########################################################################################################
+
 # --- REPORTS ---
 def safe_parse_date(d):
     if d is None:
@@ -709,16 +1456,83 @@ def safe_parse_date(d):
     except Exception:
         return None
     
+def _load_report_table(collection, start_date=None, end_date=None):
+    """
+    Report rows as an Arrow table: snapshot files for documents exported up to the watermark,
+    Firestore for documents written since (their newer copy replaces the exported one).
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    start_iso = parser.parse(start_date).date().isoformat() if start_date else None
+    # end_date is inclusive, so query up to (excluding) the next day
+    end_iso = (parser.parse(end_date).date() + timedelta(days=1)).isoformat() if end_date else None
+    version = _snapshot_version(_load_snapshot_watermarks(), collection)
+    normalize = _SNAPSHOT_NORMALIZERS[collection]
+
+    if version is None:
+        # nothing exported yet: read the range from Firestore
+        query = db.collection(collection)
+        if start_iso:
+            query = query.where("date", ">=", start_iso)
+        if end_iso:
+            query = query.where("date", "<", end_iso)
+        live = [d for d in (normalize(doc) for doc in guarded_stream(query)) if d["date_iso"]]
+        return _snapshot_table(collection, live)
+
+    snapshot = query_snapshot(collection, start_iso, end_iso)
+    query = db.collection(collection).where("updated_at", ">", _from_version(version))
+    changed = [d for d in (normalize(doc) for doc in guarded_stream(query)) if d["date_iso"]]
+    if changed:
+        stale = pc.is_in(snapshot["id"], value_set=pa.array([d["id"] for d in changed], pa.string()))
+        snapshot = snapshot.filter(pc.invert(stale))
+    live = [
+        d for d in changed
+        if (not start_iso or d["date_iso"] >= start_iso) and (not end_iso or d["date_iso"] < end_iso)
+    ]
+    return pa.concat_tables([snapshot, _snapshot_table(collection, live)])
+
 @app.get("/reports", response_class=HTMLResponse)
 async def reports_page(
     request: Request,
     start_date: str = Query(None),  # e.g., '2025-09-01'
-    end_date: str = Query(None)
+    end_date: str = Query(None),
+    source: str = Query("firestore")  # 'snapshot' = read exported rows from snapshot files
 ):
-    # Load all data
-    inv = [doc.to_dict() for doc in db.collection("inventory").stream()]
-    sales = [doc.to_dict() for doc in db.collection("sales").stream()]
-    orders = [doc.to_dict() for doc in db.collection("orders").stream()]
+    # without a range, show the current month rather than streaming every collection in full
+    # (which would trip the per-request read budget once the shop has enough history)
+    if not start_date and not end_date:
+        start_date = date.today().replace(day=1).isoformat()
+
+    if source == "snapshot":
+        import pyarrow.compute as pc
+        inv_t = _load_report_table("inventory", start_date, end_date)
+        sales_t = _load_report_table("sales", start_date, end_date)
+        orders_t = _load_report_table("orders", start_date, end_date)
+        return templates.TemplateResponse("reports.html", {
+            "request": request,
+            "inv_total": pc.sum(inv_t["total"]).as_py() or 0,
+            "sales_total": pc.sum(sales_t["total"]).as_py() or 0,
+            "inv_qty": pc.sum(inv_t["quantity"]).as_py() or 0,
+            "orders_qty": pc.sum(orders_t["quantity"]).as_py() or 0,
+            "inventory": inv_t.to_pylist(),
+            "sales": sales_t.to_pylist(),
+            "orders": orders_t.to_pylist(),
+            "start_date": start_date,
+            "end_date": end_date,
+            "source": source
+        })
+
+    # Load data, letting Firestore apply the date range so only matching documents are read
+    queries = {c: db.collection(c) for c in ("inventory", "sales", "orders")}
+    if start_date:
+        start_iso = parser.parse(start_date).date().isoformat()
+        queries = {c: q.where("date", ">=", start_iso) for c, q in queries.items()}
+    if end_date:
+        end_iso = (parser.parse(end_date).date() + timedelta(days=1)).isoformat()
+        queries = {c: q.where("date", "<", end_iso) for c, q in queries.items()}
+    inv = [doc.to_dict() for doc in guarded_stream(queries["inventory"])]
+    sales = [doc.to_dict() for doc in guarded_stream(queries["sales"])]
+    orders = [doc.to_dict() for doc in guarded_stream(queries["orders"])]
 
 
     # Then in filtering:
@@ -751,7 +1565,69 @@ async def reports_page(
         "sales": sales,
         "orders": orders,
         "start_date": start_date,
-        "end_date": end_date
+        "end_date": end_date,
+        "source": source
     })
 
-
+@app.get("/reports/margin")
+async def margin_report(
+    method: str = "fifo",
+    start_date: str = None,
+    end_date: str = None,
+    product: str = None,
+    group_by: str = "month"  # 'month' or 'day'
+):
+    """
+    Per-product / per-period revenue, cost of goods and margin from the costing engine.
+    Figures cover transactions up to the costing checkpoint (see /costing/run). "unprocessed"
+    counts transactions written since then, and "back_dated" those among them dated at or
+    before as_of: figures up to as_of change once the next run replays them.
+    """
+    if method not in COSTING_METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(COSTING_METHODS)}")
+    start_day = parser.parse(start_date).date().isoformat() if start_date else None
+    end_day = parser.parse(end_date).date().isoformat() if end_date else None
+
+    ref = _costing_ref(method)
+    checkpoint = guarded_get(ref)
+    totals = {}
+    for period_doc in guarded_stream(ref.collection("periods")):
+        month = period_doc.id
+        if (start_day and month < start_day[:7]) or (end_day and month > end_day[:7]):
+            continue
+        for day, by_product in (period_doc.to_dict() or {}).get("days", {}).items():
+            if (start_day and day < start_day) or (end_day and day > end_day):
+                continue
+            for name, row in by_product.items():
+                if product and product != "All" and name != product:
+                    continue
+                key = (day if group_by == "day" else month, name)
+                t = totals.setdefault(key, {"qty": 0.0, "revenue": 0.0, "cogs": 0.0})
+                t["qty"] += row.get("qty", 0)
+                t["revenue"] += row.get("revenue", 0)
+                t["cogs"] += row.get("cogs", 0)
+
+    rows = []
+    for (period, name), t in sorted(totals.items()):
+        margin = t["revenue"] - t["cogs"]
+        rows.append({
+            "period": period,
+            "product": name,
+            "quantity": round(t["qty"], 3),
+            "revenue": round(t["revenue"], 2),
+            "cogs": round(t["cogs"], 2),
+            "margin": round(margin, 2),
+            "margin_pct": round(margin / t["revenue"] * 100, 2) if t["revenue"] else None
+        })
+    state = (checkpoint.to_dict() or {}) if checkpoint.exists else {}
+    as_of = state.get("watermark")
+    unprocessed = back_dated = 0
+    if state.get("version") is not None:
+        for collection in ("inventory", "sales"):
+            query = db.collection(collection).where("updated_at", ">", _from_version(state["version"]))
+            for doc in guarded_stream(query.select(["date"])):
+                unprocessed += 1
+                if as_of and str(doc.get("date")) <= as_of:
+                    back_dated += 1
+    return JSONResponse({"method": method, "as_of": as_of, "unprocessed": unprocessed,
+                         "back_dated": back_dated, "rows": rows})
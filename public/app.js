@@ -0,0 +1,322 @@
+// Offline tablet client: renders from IndexedDB, pulls deltas from /sync, queues writes in an outbox.
+const DB_NAME = 'ganeshkirti';
+const DATA_STORES = ['products', 'units', 'inventory', 'sales', 'orders'];
+const ROW_STORES = ['inventory', 'sales', 'orders'];
+const MAX_ROWS_SHOWN = 200;
+const KEEP_DAYS = 7;  // same window as the server's /sync bootstrap (SYNC_RECENT_DAYS)
+const SYNC_INTERVAL_MS = 60000;
+
+const COLUMNS = {
+  inventory: ['date', 'product', 'quantity', 'unit', 'price', 'total', 'party'],
+  sales: ['date', 'product', 'quantity', 'unit', 'price', 'total'],
+  orders: ['date', 'product', 'quantity', 'unit', 'price', 'total', 'party', 'advance', 'paid_amount', 'remain_amount', 'status'],
+};
+
+let view = 'inventory';
+let syncing = false;
+
+// ---------- IndexedDB helpers ----------
+function openDb() {
+  return new Promise((resolve, reject) => {
+    const req = indexedDB.open(DB_NAME, 2);
+    req.onupgradeneeded = event => {
+      const db = req.result;
+      if (event.oldVersion < 1) {
+        for (const name of DATA_STORES) db.createObjectStore(name, { keyPath: 'id' });
+        db.createObjectStore('outbox', { keyPath: 'id' });
+        db.createObjectStore('meta');
+      }
+      if (event.oldVersion < 2) {
+        // rows are read newest-first and pruned by date, without loading whole stores
+        for (const name of ROW_STORES) req.transaction.objectStore(name).createIndex('date_iso', 'date_iso');
+      }
+    };
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+  });
+}
+const dbPromise = openDb();
+
+async function tx(stores, mode, fn) {
+  const db = await dbPromise;
+  return new Promise((resolve, reject) => {
+    const t = db.transaction(stores, mode);
+    const result = fn(t);
+    t.oncomplete = () => resolve(result);
+    t.onerror = () => reject(t.error);
+  });
+}
+
+function getAll(store) {
+  return dbPromise.then(db => new Promise((resolve, reject) => {
+    const req = db.transaction(store).objectStore(store).getAll();
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+  }));
+}
+
+function getMeta(key) {
+  return dbPromise.then(db => new Promise((resolve, reject) => {
+    const req = db.transaction('meta').objectStore('meta').get(key);
+    req.onsuccess = () => resolve(req.result);
+    req.onerror = () => reject(req.error);
+  }));
+}
+
+// ---------- sync ----------
+async function pushOutbox() {
+  // replay in the order they were made (an order update may follow its own offline add)
+  const ops = (await getAll('outbox')).sort((a, b) => a.queued_at - b.queued_at);
+  if (!ops.length) return;
+  const res = await fetch('/sync/push', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(ops.map(({ id, collection, op, doc_id, data }) => ({ id, collection, op, doc_id, data }))),
+  });
+  if (!res.ok) throw new Error(`push failed: ${res.status}`);
+  const js = await res.json();
+  // rejected ops would fail on every retry, so they are dropped (and logged) as well,
+  // and their optimistic local rows are undone: removed for adds, restored for updates
+  const failedIds = new Set((js.failed || []).map(f => f.id));
+  for (const f of js.failed || []) console.warn('sync op rejected', f);
+  const done = new Set([...(js.applied || []), ...failedIds]);
+  await tx(['outbox', ...ROW_STORES], 'readwrite', t => {
+    const removed = new Set();
+    for (const op of ops) {
+      if (!done.has(op.id)) continue;
+      t.objectStore('outbox').delete(op.id);
+      if (!failedIds.has(op.id)) continue;
+      if (op.op === 'add') {
+        t.objectStore(op.collection).delete(op.id);
+        removed.add(op.id);
+      } else if (op.rollback && !removed.has(op.doc_id)) {
+        t.objectStore(op.collection).put(op.rollback);
+      }
+    }
+  });
+}
+
+async function pruneOldRows() {
+  const cutoff = new Date(Date.now() - KEEP_DAYS * 86400000).toISOString().slice(0, 10);
+  await tx(ROW_STORES, 'readwrite', t => {
+    for (const name of ROW_STORES) {
+      const req = t.objectStore(name).index('date_iso').openCursor(IDBKeyRange.upperBound(cutoff, true));
+      req.onsuccess = () => {
+        const cursor = req.result;
+        if (!cursor) return;
+        if (!cursor.value.pending) cursor.delete();
+        cursor.continue();
+      };
+    }
+  });
+}
+
+async function pullDeltas() {
+  let version = await getMeta('version');
+  // a bootstrap interrupted mid-way resumes from its cursor instead of starting over
+  let cursor = await getMeta('bootstrap_cursor');
+  for (;;) {
+    let url = `/sync?since=${version}`;
+    if (version == null) url = cursor ? `/sync?cursor=${encodeURIComponent(cursor)}` : '/sync';
+    const res = await fetch(url);
+    if (!res.ok) throw new Error(`sync failed: ${res.status}`);
+    const js = await res.json();
+    await tx([...DATA_STORES, 'meta'], 'readwrite', t => {
+      for (const name of DATA_STORES) {
+        for (const row of js[name] || []) t.objectStore(name).put(row);
+      }
+      // bootstrap pages carry no version until the last one
+      if (js.version != null) {
+        t.objectStore('meta').put(js.version, 'version');
+        t.objectStore('meta').delete('bootstrap_cursor');
+        t.objectStore('meta').put(new Date().toISOString(), 'last_sync');
+      } else {
+        t.objectStore('meta').put(js.next_cursor, 'bootstrap_cursor');
+      }
+    });
+    version = js.version;
+    cursor = js.next_cursor;
+    if (!js.has_more) break;
+  }
+}
+
+async function syncNow() {
+  if (syncing || !navigator.onLine) return;
+  syncing = true;
+  try {
+    await pushOutbox();
+    await pullDeltas();
+    await pruneOldRows();
+  } catch (err) {
+    console.error('sync error', err);
+  } finally {
+    syncing = false;
+    render();
+  }
+}
+
+// ---------- local writes ----------
+function localDate(value) {
+  // datetime-local value (YYYY-MM-DDTHH:MM) -> the date fields the server returns
+  return { date: value.replace('T', ' ').slice(0, 16), date_iso: value.length === 16 ? `${value}:00` : value };
+}
+
+async function queueOp(collection, op, data, docId, localRow, rollback) {
+  const id = crypto.randomUUID();
+  await tx(['outbox', collection], 'readwrite', t => {
+    t.objectStore('outbox').put({ id, collection, op, doc_id: docId || null, data, rollback: rollback || null, queued_at: Date.now() });
+    // adds use the op id as document id on the server, so the synced row replaces this one
+    if (localRow) t.objectStore(collection).put({ ...localRow, id: docId || id, pending: true });
+  });
+  render();
+  syncNow();
+}
+
+async function addEntry(form) {
+  const f = Object.fromEntries(new FormData(form).entries());
+  const data = {
+    date: f.date, product: f.product, unit: f.unit,
+    quantity: parseFloat(f.quantity), price: parseFloat(f.price),
+  };
+  if (view !== 'sales') data.party = f.party || '';
+  if (view === 'orders') data.advance = parseFloat(f.advance || 0);
+  const total = data.quantity * data.price;
+  const row = { ...data, ...localDate(f.date), total };
+  if (view === 'orders') Object.assign(row, { paid_amount: 0, remain_amount: total - data.advance, status: 'Pending' });
+  await queueOp(view, 'add', data, null, row);
+  form.reset();
+  setDefaultDate();
+}
+
+async function updateOrder(row, changes) {
+  const updated = { ...row, ...changes };
+  updated.remain_amount = updated.total - updated.advance - updated.paid_amount;
+  await queueOp('orders', 'update', {
+    status: updated.status, advance: updated.advance,
+    paid_amount: updated.paid_amount, remain_amount: updated.remain_amount,
+  }, row.id, updated, row);
+}
+
+// ---------- rendering ----------
+function cell(row, col) {
+  const v = row[col];
+  if (['price', 'total', 'advance', 'paid_amount', 'remain_amount'].includes(col)) return Number(v || 0).toFixed(2);
+  return v == null ? '' : String(v);
+}
+
+async function renderStatus() {
+  const pending = (await getAll('outbox')).length;
+  const lastSync = await getMeta('last_sync');
+  const net = document.getElementById('net-status');
+  net.textContent = navigator.onLine ? 'online' : 'offline';
+  net.className = `badge ${navigator.onLine ? 'bg-success' : 'bg-warning text-dark'}`;
+  document.getElementById('pending-status').textContent = pending ? `${pending} unsynced` : '';
+  document.getElementById('sync-status').textContent = lastSync ? `synced ${new Date(lastSync).toLocaleTimeString()}` : 'not synced yet';
+}
+
+async function renderOptions() {
+  const products = await getAll('products');
+  const units = (await getAll('units')).map(u => u.name || u.id);
+  const productSelect = document.getElementById('product-select');
+  const unitSelect = document.getElementById('unit-select');
+  const current = productSelect.value;
+  // synced values are free text from other devices: build nodes, never innerHTML
+  productSelect.replaceChildren(...products.map(p => {
+    const name = String(p.name || p.id);
+    const opt = new Option(name, name);
+    opt.dataset.unit = p.unit || '';
+    return opt;
+  }));
+  if (current) productSelect.value = current;
+  unitSelect.replaceChildren(...(units.length ? units : ['kg', 'ltr', 'nos']).map(u => new Option(String(u), String(u))));
+  setPreferredUnit();
+}
+
+function setPreferredUnit() {
+  const opt = document.getElementById('product-select').selectedOptions[0];
+  const unitSelect = document.getElementById('unit-select');
+  if (opt && opt.dataset.unit && [...unitSelect.options].some(o => o.value === opt.dataset.unit)) {
+    unitSelect.value = opt.dataset.unit;
+  }
+}
+
+function recentRows(store, max) {
+  // newest first via the date_iso index, stopping after `max` rows
+  return dbPromise.then(db => new Promise((resolve, reject) => {
+    const rows = [];
+    const req = db.transaction(store).objectStore(store).index('date_iso').openCursor(null, 'prev');
+    req.onsuccess = () => {
+      const cursor = req.result;
+      if (!cursor || rows.length >= max) return resolve(rows);
+      rows.push(cursor.value);
+      cursor.continue();
+    };
+    req.onerror = () => reject(req.error);
+  }));
+}
+
+async function renderRows() {
+  const cols = COLUMNS[view];
+  document.getElementById('rows-head').innerHTML = cols.map(c => `<th>${c.replace('_', ' ')}</th>`).join('');
+  const rows = await recentRows(view, MAX_ROWS_SHOWN);
+  const tbody = document.getElementById('rows-body');
+  tbody.replaceChildren();
+  for (const row of rows) {
+    const tr = document.createElement('tr');
+    if (row.pending) tr.className = 'table-warning';
+    for (const c of cols) {
+      const td = document.createElement('td');
+      td.textContent = cell(row, c);
+      tr.appendChild(td);
+    }
+    if (view === 'orders') {
+      const statusTd = tr.lastElementChild;
+      const select = document.createElement('select');
+      select.className = 'form-select form-select-sm';
+      for (const s of ['Pending', 'Completed', 'Cancelled']) select.add(new Option(s, s, false, s === row.status));
+      select.addEventListener('change', e => updateOrder(row, { status: e.target.value }));
+      statusTd.replaceChildren(select);
+      const paidTd = tr.children[cols.indexOf('paid_amount')];
+      const paid = document.createElement('input');
+      paid.type = 'number';
+      paid.step = '0.01';
+      paid.className = 'form-control form-control-sm';
+      paid.value = cell(row, 'paid_amount');
+      paid.addEventListener('change', e => updateOrder(row, { paid_amount: parseFloat(e.target.value || 0) }));
+      paidTd.replaceChildren(paid);
+    }
+    tbody.appendChild(tr);
+  }
+}
+
+function render() {
+  document.querySelectorAll('.field-party').forEach(el => { el.style.display = view === 'sales' ? 'none' : ''; });
+  document.querySelectorAll('.field-advance').forEach(el => { el.style.display = view === 'orders' ? '' : 'none'; });
+  return Promise.all([renderStatus(), renderOptions(), renderRows()]);
+}
+
+function setDefaultDate() {
+  const now = new Date();
+  now.setMinutes(now.getMinutes() - now.getTimezoneOffset());
+  document.querySelector('#entry-form [name=date]').value = now.toISOString().slice(0, 16);
+}
+
+// ---------- wiring ----------
+document.querySelectorAll('[data-view]').forEach(btn => btn.addEventListener('click', () => {
+  document.querySelectorAll('[data-view]').forEach(b => b.classList.toggle('active', b === btn));
+  view = btn.dataset.view;
+  render();
+}));
+document.getElementById('entry-form').addEventListener('submit', e => { e.preventDefault(); addEntry(e.target); });
+document.getElementById('product-select').addEventListener('change', setPreferredUnit);
+document.getElementById('sync-now').addEventListener('click', syncNow);
+window.addEventListener('online', syncNow);
+window.addEventListener('offline', renderStatus);
+setInterval(() => { if (document.visibilityState === 'visible') syncNow(); }, SYNC_INTERVAL_MS);
+
+if ('serviceWorker' in navigator) {
+  navigator.serviceWorker.register('sw.js').catch(err => console.error('service worker registration failed', err));
+}
+
+setDefaultDate();
+render().then(syncNow);
@@ -0,0 +1,38 @@
+// Service worker for the tablet client: serves the app shell (and Bootstrap CSS) from cache so
+// the page opens without the network. Data requests (/sync, /sync/push) always go to the server.
+const CACHE = 'ganeshkirti-shell-v4';
+const SHELL = ['./', 'index.html', 'app.js', 'manifest.json', 'icon.svg'];
+const CDN_HOST = 'cdn.jsdelivr.net';
+
+self.addEventListener('install', event => {
+  event.waitUntil(caches.open(CACHE).then(cache => cache.addAll(SHELL)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(keys => Promise.all(keys.filter(k => k !== CACHE).map(k => caches.delete(k))))
+      .then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener('fetch', event => {
+  const req = event.request;
+  const url = new URL(req.url);
+  const isShell = url.href.startsWith(self.registration.scope);
+  if (req.method !== 'GET' || !(isShell || url.host === CDN_HOST)) return;
+
+  // stale-while-revalidate: answer from cache, refresh the cached copy in the background
+  event.respondWith(caches.open(CACHE).then(async cache => {
+    const cached = await cache.match(req, { ignoreSearch: isShell });
+    const network = fetch(req).then(res => {
+      if (res.ok || res.type === 'opaque') cache.put(req, res.clone());
+      return res;
+    });
+    if (cached) {
+      event.waitUntil(network.catch(() => undefined));
+      return cached;
+    }
+    return network;
+  }));
+});